@@ -6,6 +6,9 @@ from openpyxl.chart import PieChart, BarChart, Reference
 import tkinter as tk
 from tkinter import filedialog, messagebox
 import os
+import signal
+import stat
+import tempfile
 from datetime import datetime
 import re
 from pandas import isna
@@ -63,39 +66,43 @@ def clean_date_value(date_value):
     print(f"Valor de data inválido: {date_value} (tipo: {type(date_value)})")
     return None
 
+# Função para ler e limpar dados de CMCL904-CLIENTE-CC.xlsx (levanta exceção em caso de erro)
+def read_client_data(file_path):
+    # Carrega a primeira aba do arquivo
+    df = pd.read_excel(file_path, sheet_name=0, dtype={'Emissão': str, 'IDA': str, 'VOLTA': str})
+    df.columns = df.columns.str.strip()
+    
+    # Lista de colunas esperadas
+    required_columns = ['Razão Social', 'cnpj', 'Centro de Custo', 'Fornecedor', 'Tarifas', 
+                       'Tx.Embq.', 'Tx.Serviço', 'Total', 'Passageiro', 'Solicitante', 
+                       'Documento', 'Trecho', 'Emissão', 'IDA', 'VOLTA','LOCALIZADOR-TKT']
+    
+    # Verifica se todas as colunas necessárias estão presentes
+    missing_columns = [col for col in required_columns if col not in df.columns]
+    if missing_columns:
+        raise ValueError(f"Colunas ausentes no arquivo: {', '.join(missing_columns)}")
+    
+    # Limpa valores monetários
+    monetary_cols = ['Tarifas', 'Tx.Embq.', 'Tx.Serviço', 'Tx.Extra', 'Total', 'Valor Medio']
+    for col in monetary_cols:
+        if col in df.columns:
+            df[col] = df[col].apply(clean_monetary_value)
+    
+    # Limpa valores de data
+    df['Emissão'] = df['Emissão'].apply(clean_date_value)
+    df['IDA'] = df['IDA'].apply(clean_date_value)
+    df['VOLTA'] = df['VOLTA'].apply(clean_date_value)
+    
+    # Filtra linhas de totais/subtotais
+    df = df[~df['Razão Social'].str.contains('Total|Subtotal', na=False, case=False, regex=True)]
+    df = df[~df['Trecho'].str.contains('Total|Subtotal', na=False, case=False, regex=True)]
+    
+    return df
+
 # Função para carregar e limpar dados de CMCL904-CLIENTE-CC.xlsx
 def load_client_data(file_path):
     try:
-        # Carrega a primeira aba do arquivo
-        df = pd.read_excel(file_path, sheet_name=0, dtype={'Emissão': str, 'IDA': str, 'VOLTA': str})
-        df.columns = df.columns.str.strip()
-        
-        # Lista de colunas esperadas
-        required_columns = ['Razão Social', 'cnpj', 'Centro de Custo', 'Fornecedor', 'Tarifas', 
-                           'Tx.Embq.', 'Tx.Serviço', 'Total', 'Passageiro', 'Solicitante', 
-                           'Documento', 'Trecho', 'Emissão', 'IDA', 'VOLTA','LOCALIZADOR-TKT']
-        
-        # Verifica se todas as colunas necessárias estão presentes
-        missing_columns = [col for col in required_columns if col not in df.columns]
-        if missing_columns:
-            raise ValueError(f"Colunas ausentes no arquivo: {', '.join(missing_columns)}")
-        
-        # Limpa valores monetários
-        monetary_cols = ['Tarifas', 'Tx.Embq.', 'Tx.Serviço', 'Tx.Extra', 'Total', 'Valor Medio']
-        for col in monetary_cols:
-            if col in df.columns:
-                df[col] = df[col].apply(clean_monetary_value)
-        
-        # Limpa valores de data
-        df['Emissão'] = df['Emissão'].apply(clean_date_value)
-        df['IDA'] = df['IDA'].apply(clean_date_value)
-        df['VOLTA'] = df['VOLTA'].apply(clean_date_value)
-        
-        # Filtra linhas de totais/subtotais
-        df = df[~df['Razão Social'].str.contains('Total|Subtotal', na=False, case=False, regex=True)]
-        df = df[~df['Trecho'].str.contains('Total|Subtotal', na=False, case=False, regex=True)]
-        
-        return df
+        return read_client_data(file_path)
     except FileNotFoundError:
         messagebox.showerror("Erro", f"Arquivo não encontrado: {file_path}")
         return None
@@ -106,17 +113,21 @@ def load_client_data(file_path):
         messagebox.showerror("Erro", f"Falha ao carregar dados do cliente: {str(e)}. Verifique o formato do arquivo e o nome das colunas.")
         return None
 
+# Função para ler e limpar dados de CMCL904-FORNECEDOR.xlsx (levanta exceção em caso de erro)
+def read_supplier_data(file_path):
+    df = pd.read_excel(file_path, sheet_name=0)
+    df.columns = df.columns.str.strip()
+    monetary_cols = ['Tarifas', 'Tx.Embq.', 'Tx.Serviço', 'Tx.Extra', 'Total', 'Valor Medio']
+    for col in monetary_cols:
+        if col in df.columns:
+            df[col] = df[col].apply(clean_monetary_value)
+    df = df[~df['Fornecedor'].str.contains('Total', na=False, case=False)]
+    return df
+
 # Função para carregar e limpar dados de CMCL904-FORNECEDOR.xlsx
 def load_supplier_data(file_path):
     try:
-        df = pd.read_excel(file_path, sheet_name=0)
-        df.columns = df.columns.str.strip()
-        monetary_cols = ['Tarifas', 'Tx.Embq.', 'Tx.Serviço', 'Tx.Extra', 'Total', 'Valor Medio']
-        for col in monetary_cols:
-            if col in df.columns:
-                df[col] = df[col].apply(clean_monetary_value)
-        df = df[~df['Fornecedor'].str.contains('Total', na=False, case=False)]
-        return df
+        return read_supplier_data(file_path)
     except FileNotFoundError:
         messagebox.showerror("Erro", f"Arquivo não encontrado: {file_path}")
         return None
@@ -621,6 +632,87 @@ def create_creditos_disponiveis_sheet(client_df, workbook):
         adjusted_width = max_length + 2
         ws.column_dimensions[column].width = adjusted_width
 
+# Abas do relatório, na ordem em que são criadas
+REPORT_SHEET_BUILDERS = [
+    create_emissoes_sheet,
+    create_emissao_reemissao_sheet,
+    create_empresa_sheet,
+    create_centro_custo_sheet,
+    create_cia_aerea_sheet,
+    create_cia_trecho_sheet,
+    create_solicitante_sheet,
+    create_creditos_disponiveis_sheet,
+]
+
+# Função para montar o workbook de saída com todas as abas do relatório
+# (progress, se informado, é chamado como progress(etapa_atual, total_etapas, descricao))
+def build_report_workbook(client_df, progress=None, first_step=0, total_steps=None):
+    total_steps = total_steps or len(REPORT_SHEET_BUILDERS)
+    wb = openpyxl.Workbook()
+    wb.remove(wb['Sheet'])
+    
+    for step, builder in enumerate(REPORT_SHEET_BUILDERS, first_step + 1):
+        builder(client_df, wb)
+        if progress:
+            progress(step, total_steps, f"Aba {wb.worksheets[-1].title}")
+    
+    return wb
+
+# Função para obter a umask do processo (os.umask só permite ler alterando e restaurando o valor)
+def _current_umask():
+    umask = os.umask(0)
+    os.umask(umask)
+    return umask
+
+# Função para salvar o workbook de forma atômica (arquivo temporário + rename),
+# evitando que outro processo leia um relatório gravado pela metade
+def save_workbook_atomic(workbook, output_file):
+    output_dir = os.path.dirname(os.path.abspath(output_file))
+    fd, temp_file = tempfile.mkstemp(prefix='.', suffix='.xlsx.tmp', dir=output_dir)
+    os.close(fd)
+    try:
+        workbook.save(temp_file)
+        # mkstemp cria o arquivo com permissão 0o600; usa a permissão que um arquivo novo teria
+        # (respeitando a umask) ou mantém a do relatório que está sendo substituído
+        if os.path.exists(output_file):
+            mode = stat.S_IMODE(os.stat(output_file).st_mode)
+        else:
+            mode = 0o666 & ~_current_umask()
+        os.chmod(temp_file, mode)
+        os.replace(temp_file, output_file)
+    except BaseException:
+        if os.path.exists(temp_file):
+            os.remove(temp_file)
+        raise
+
+# Função para gerar o relatório sem interface gráfica (levanta exceção em caso de erro)
+def write_report(client_file, supplier_file, output_file, progress=None):
+    # Etapas: leitura das entradas, uma por aba e gravação do arquivo
+    total_steps = len(REPORT_SHEET_BUILDERS) + 2
+    client_df = read_client_data(client_file)
+    read_supplier_data(supplier_file)
+    if progress:
+        progress(1, total_steps, "Leitura dos arquivos")
+    wb = build_report_workbook(client_df, progress, first_step=1, total_steps=total_steps)
+    save_workbook_atomic(wb, output_file)
+    if progress:
+        progress(total_steps, total_steps, "Gravação do relatório")
+    return output_file
+
+# Função de inicialização dos processos de trabalho (monitoramento e serviço HTTP): o Ctrl+C é
+# tratado só pelo processo principal, que aguarda os relatórios em andamento antes de encerrar
+def ignore_sigint():
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+
+# Função executada nos processos de trabalho para gerar um relatório; se houver fila, o progresso
+# é enviado por ela como (job_id, etapa_atual, total_etapas, descricao)
+def run_report_job(client_file, supplier_file, output_file, progress_queue=None, job_id=None):
+    progress = None
+    if progress_queue is not None:
+        def progress(step, total_steps, description):
+            progress_queue.put((job_id, step, total_steps, description))
+    return write_report(client_file, supplier_file, output_file, progress=progress)
+
 # Função principal para processar arquivos e gerar saída
 def process_files(client_file, supplier_file, output_file):
     client_df = load_client_data(client_file)
@@ -629,20 +721,10 @@ def process_files(client_file, supplier_file, output_file):
     if client_df is None or supplier_df is None:
         return
     
-    wb = openpyxl.Workbook()
-    wb.remove(wb['Sheet'])
-    
-    create_emissoes_sheet(client_df, wb)
-    create_emissao_reemissao_sheet(client_df, wb)
-    create_empresa_sheet(client_df, wb)
-    create_centro_custo_sheet(client_df, wb)
-    create_cia_aerea_sheet(client_df, wb)
-    create_cia_trecho_sheet(client_df, wb)
-    create_solicitante_sheet(client_df, wb)
-    create_creditos_disponiveis_sheet(client_df, wb)
+    wb = build_report_workbook(client_df)
     
     try:
-        wb.save(output_file)
+        save_workbook_atomic(wb, output_file)
         messagebox.showinfo("Sucesso", f"Arquivo Excel gerado com sucesso em {output_file}")
     except Exception as e:
         messagebox.showerror("Erro", f"Falha ao salvar arquivo Excel: {str(e)}")
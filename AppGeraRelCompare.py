@@ -0,0 +1,263 @@
+import argparse
+import contextlib
+import os
+import posixpath
+import sys
+import tempfile
+import zipfile
+from itertools import zip_longest
+from xml.etree.ElementTree import iterparse, parse
+
+import openpyxl
+from openpyxl.utils import get_column_letter
+
+# Tolerância padrão para valores monetários (meio centavo)
+MONEY_TOLERANCE = 0.005
+# Tolerância para largura de coluna
+WIDTH_TOLERANCE = 0.01
+
+# Entradas de teste e saída de referência (golden) geradas a partir de teste_data/
+TEST_DATA_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'teste_data')
+GOLDEN_CASES = [
+    # (relatório de referência, arquivo do cliente, arquivo do fornecedor)
+    # Datas no formato das exportações anonimizadas (AAAA-MM), que não são reconhecidas
+    ('CMCL999-RELATORIO-golden.xlsx', 'CMCL999-TOTAL-CLIENTE-TKT-anon.xlsx', 'CMCL999-CLIENTE-FORNECEDOR-anon.xlsx'),
+    # Datas DD/MM/AAAA, com IDA/VOLTA no ano 1901 (substituído pelo ano corrente)
+    ('CMCL999-RELATORIO-DATAS-golden.xlsx', 'CMCL999-TOTAL-CLIENTE-DATAS-anon.xlsx', 'CMCL999-CLIENTE-FORNECEDOR-anon.xlsx'),
+]
+# Ano corrente fixo na geração das referências, para que as datas de 1901 não mudem a cada virada de ano
+GOLDEN_CURRENT_YEAR = 2025
+
+NS_MAIN = '{http://schemas.openxmlformats.org/spreadsheetml/2006/main}'
+NS_REL = '{http://schemas.openxmlformats.org/officeDocument/2006/relationships}'
+NS_PKG_REL = '{http://schemas.openxmlformats.org/package/2006/relationships}'
+NS_CHART = '{http://schemas.openxmlformats.org/drawingml/2006/chart}'
+NS_DRAWING = '{http://schemas.openxmlformats.org/drawingml/2006/main}'
+
+# Função para resolver o destino de um relacionamento do pacote .xlsx
+def _resolve_target(source_part, target):
+    if target.startswith('/'):
+        return target.lstrip('/')
+    return posixpath.normpath(posixpath.join(posixpath.dirname(source_part), target))
+
+# Função para ler o arquivo de relacionamentos (.rels) de uma parte do pacote
+def _read_rels(archive, part):
+    rels_part = posixpath.join(posixpath.dirname(part), '_rels', posixpath.basename(part) + '.rels')
+    try:
+        data = archive.open(rels_part)
+    except KeyError:
+        return {}
+    rels = {}
+    with data:
+        for _, elem in iterparse(data):
+            if elem.tag == NS_PKG_REL + 'Relationship':
+                rels[elem.get('Id')] = (elem.get('Type', '').rsplit('/', 1)[-1],
+                                        _resolve_target(part, elem.get('Target')))
+    return rels
+
+# Função para mapear o nome de cada aba para a parte XML correspondente
+def _sheet_parts(archive):
+    workbook_part = next((target for kind, target in _read_rels(archive, '').values()
+                          if kind == 'officeDocument'), 'xl/workbook.xml')
+    rels = _read_rels(archive, workbook_part)
+    parts = {}
+    with archive.open(workbook_part) as data:
+        for _, elem in iterparse(data):
+            if elem.tag == NS_MAIN + 'sheet':
+                rel = rels.get(elem.get(NS_REL + 'id'))
+                if rel:
+                    parts[elem.get('name')] = rel[1]
+    return parts
+
+# Função para ler as larguras de coluna de uma aba (lê só até o início dos dados)
+def _column_widths(archive, sheet_part):
+    widths = {}
+    with archive.open(sheet_part) as data:
+        for event, elem in iterparse(data, events=('start', 'end')):
+            if event == 'start' and elem.tag == NS_MAIN + 'sheetData':
+                break
+            if event == 'end' and elem.tag == NS_MAIN + 'col' and elem.get('width') is not None:
+                width = float(elem.get('width'))
+                for col in range(int(elem.get('min')), int(elem.get('max')) + 1):
+                    widths[get_column_letter(col)] = width
+    return widths
+
+# Função para listar os gráficos de uma aba como (tipo, título)
+def _sheet_charts(archive, sheet_part):
+    charts = []
+    for kind, drawing_part in _read_rels(archive, sheet_part).values():
+        if kind != 'drawing':
+            continue
+        for chart_kind, chart_part in _read_rels(archive, drawing_part).values():
+            if chart_kind != 'chart':
+                continue
+            # As partes de gráfico são pequenas, então podem ser lidas inteiras
+            with archive.open(chart_part) as data:
+                chart = parse(data).getroot().find(NS_CHART + 'chart')
+            plot_area = chart.find(NS_CHART + 'plotArea')
+            chart_types = [elem.tag[len(NS_CHART):] for elem in plot_area
+                           if elem.tag.endswith('Chart')] if plot_area is not None else []
+            title_elem = chart.find(NS_CHART + 'title')
+            title = ''.join(t.text or '' for t in title_elem.iter(NS_DRAWING + 't')) if title_elem is not None else ''
+            charts.append(('+'.join(chart_types), title))
+    return sorted(charts)
+
+# Função para normalizar o valor de uma célula para comparação
+def _cell_value(cell):
+    value = None if cell is None else cell.value
+    return None if value == '' else value
+
+# Função para descrever o preenchimento de uma célula
+def _cell_fill(cell):
+    if cell is None or cell.fill is None or cell.fill.fill_type is None:
+        return None
+    return (cell.fill.fill_type, cell.fill.fgColor.rgb)
+
+def _is_number(value):
+    return isinstance(value, (int, float)) and not isinstance(value, bool)
+
+# Função para comparar dois valores, com tolerância para números
+def values_equal(expected, actual, tolerance=MONEY_TOLERANCE):
+    if _is_number(expected) and _is_number(actual):
+        return abs(expected - actual) <= tolerance
+    return expected == actual and type(expected) is type(actual)
+
+# Acumula as diferenças encontradas, guardando apenas as primeiras para o relatório
+class ComparisonResult:
+    def __init__(self, max_details=50):
+        self.max_details = max_details
+        self.count = 0
+        self.details = []
+        self.cells_compared = 0
+
+    def add(self, sheet, where, message):
+        self.count += 1
+        if len(self.details) < self.max_details:
+            self.details.append(f"[{sheet}] {where}: {message}")
+
+    @property
+    def equivalent(self):
+        return self.count == 0
+
+# Função para comparar as células de uma aba lendo as duas planilhas linha a linha
+def compare_sheet_cells(expected_ws, actual_ws, result, tolerance=MONEY_TOLERANCE):
+    sheet = expected_ws.title
+    rows = zip_longest(expected_ws.iter_rows(), actual_ws.iter_rows(), fillvalue=())
+    for row_idx, (expected_row, actual_row) in enumerate(rows, 1):
+        for col_idx, (expected, actual) in enumerate(zip_longest(expected_row, actual_row), 1):
+            result.cells_compared += 1
+            where = f"{get_column_letter(col_idx)}{row_idx}"
+            expected_value, actual_value = _cell_value(expected), _cell_value(actual)
+            if not values_equal(expected_value, actual_value, tolerance):
+                result.add(sheet, where, f"valor {expected_value!r} != {actual_value!r}")
+            if expected_value is None and actual_value is None:
+                expected_format = actual_format = None
+            else:
+                expected_format = expected.number_format if expected is not None else 'General'
+                actual_format = actual.number_format if actual is not None else 'General'
+            if expected_format != actual_format:
+                result.add(sheet, where, f"formato {expected_format!r} != {actual_format!r}")
+            expected_fill, actual_fill = _cell_fill(expected), _cell_fill(actual)
+            if expected_fill != actual_fill:
+                result.add(sheet, where, f"preenchimento {expected_fill} != {actual_fill}")
+
+# Função para comparar dois relatórios gerados, aba por aba
+def compare_workbooks(expected_file, actual_file, tolerance=MONEY_TOLERANCE, max_details=50):
+    result = ComparisonResult(max_details)
+    expected_wb = openpyxl.load_workbook(expected_file, read_only=True)
+    actual_wb = openpyxl.load_workbook(actual_file, read_only=True)
+    try:
+        with zipfile.ZipFile(expected_file) as expected_zip, zipfile.ZipFile(actual_file) as actual_zip:
+            if expected_wb.sheetnames != actual_wb.sheetnames:
+                result.add('workbook', 'abas', f"{expected_wb.sheetnames} != {actual_wb.sheetnames}")
+            expected_parts, actual_parts = _sheet_parts(expected_zip), _sheet_parts(actual_zip)
+            for name in expected_wb.sheetnames:
+                if name not in actual_wb.sheetnames:
+                    continue
+                expected_widths = _column_widths(expected_zip, expected_parts[name])
+                actual_widths = _column_widths(actual_zip, actual_parts[name])
+                for column in sorted(set(expected_widths) | set(actual_widths), key=lambda c: (len(c), c)):
+                    expected_width, actual_width = expected_widths.get(column), actual_widths.get(column)
+                    if (expected_width is None or actual_width is None
+                            or abs(expected_width - actual_width) > WIDTH_TOLERANCE):
+                        result.add(name, f"coluna {column}", f"largura {expected_width} != {actual_width}")
+                expected_charts = _sheet_charts(expected_zip, expected_parts[name])
+                actual_charts = _sheet_charts(actual_zip, actual_parts[name])
+                if expected_charts != actual_charts:
+                    result.add(name, 'gráficos', f"{expected_charts} != {actual_charts}")
+                compare_sheet_cells(expected_wb[name], actual_wb[name], result, tolerance)
+    finally:
+        expected_wb.close()
+        actual_wb.close()
+    return result
+
+# Função para gerar a saída atual a partir das entradas de teste
+def generate_case_output(client_file, supplier_file, output_file):
+    # Importado aqui para que a comparação de dois arquivos não dependa do motor de relatórios
+    import AppGeraRel
+    current_year = AppGeraRel.CURRENT_YEAR
+    AppGeraRel.CURRENT_YEAR = GOLDEN_CURRENT_YEAR
+    # O motor imprime um aviso por data não reconhecida (milhares no primeiro caso, de propósito);
+    # a saída é descartada para que só o resultado da comparação apareça
+    try:
+        with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+            return AppGeraRel.write_report(os.path.join(TEST_DATA_DIR, client_file),
+                                           os.path.join(TEST_DATA_DIR, supplier_file), output_file)
+    finally:
+        AppGeraRel.CURRENT_YEAR = current_year
+
+# Função para regravar as saídas de referência em teste_data/
+def update_golden():
+    for golden, client_file, supplier_file in GOLDEN_CASES:
+        output_file = generate_case_output(client_file, supplier_file, os.path.join(TEST_DATA_DIR, golden))
+        print(f"Referência gravada: {output_file}")
+
+# Função para gerar a saída atual e compará-la com as referências; retorna True se tudo for equivalente
+def check_golden(tolerance=MONEY_TOLERANCE, max_details=50):
+    ok = True
+    with tempfile.TemporaryDirectory() as temp_dir:
+        for golden, client_file, supplier_file in GOLDEN_CASES:
+            output_file = generate_case_output(client_file, supplier_file, os.path.join(temp_dir, golden))
+            result = compare_workbooks(os.path.join(TEST_DATA_DIR, golden), output_file, tolerance, max_details)
+            print_result(golden, result)
+            ok = ok and result.equivalent
+    return ok
+
+def print_result(label, result):
+    if result.equivalent:
+        print(f"OK {label}: {result.cells_compared} células equivalentes")
+        return
+    print(f"DIFERENTE {label}: {result.count} diferença(s) em {result.cells_compared} células")
+    for detail in result.details:
+        print(f"  {detail}")
+    if result.count > len(result.details):
+        print(f"  ... e mais {result.count - len(result.details)} diferença(s)")
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Compara dois relatórios Excel gerados (valores, formatos, preenchimentos, larguras e gráficos).")
+    parser.add_argument('esperado', nargs='?', help="Relatório de referência")
+    parser.add_argument('atual', nargs='?', help="Relatório a verificar")
+    parser.add_argument('--tolerancia', type=float, default=MONEY_TOLERANCE,
+                        help=f"Diferença máxima aceita entre valores numéricos (padrão: {MONEY_TOLERANCE})")
+    parser.add_argument('--max-diferencas', type=int, default=50, help="Número máximo de diferenças listadas (padrão: 50)")
+    parser.add_argument('--golden', action='store_true',
+                        help="Gera a saída atual a partir de teste_data/ e compara com as referências")
+    parser.add_argument('--atualizar-golden', action='store_true',
+                        help="Regrava as saídas de referência em teste_data/ com o motor atual")
+    args = parser.parse_args(argv)
+
+    if args.atualizar_golden:
+        update_golden()
+        return 0
+    if args.golden:
+        return 0 if check_golden(args.tolerancia, args.max_diferencas) else 1
+    if not args.esperado or not args.atual:
+        parser.error("informe os dois relatórios ou use --golden")
+    result = compare_workbooks(args.esperado, args.atual, args.tolerancia, args.max_diferencas)
+    print_result(os.path.basename(args.atual), result)
+    return 0 if result.equivalent else 1
+
+# Executar a comparação
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,495 @@
+import argparse
+import asyncio
+import hashlib
+import json
+import logging
+import multiprocessing
+import os
+import re
+import shutil
+import sys
+import tempfile
+import threading
+import time
+import uuid
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from email.message import Message
+from http import HTTPStatus
+
+from AppGeraRel import CURRENT_YEAR, ignore_sigint, run_report_job
+
+# Versão do formato do relatório: altere quando a saída mudar para invalidar o cache
+REPORT_FORMAT_VERSION = 1
+
+# Limite de jobs concluídos mantidos em memória para consulta de status
+MAX_FINISHED_JOBS = 1000
+
+# Número de vezes que um job é reenviado se o processo de trabalho morrer durante a geração
+MAX_POOL_RESTARTS = 2
+
+# Tamanho dos blocos lidos do corpo da requisição e limite dos cabeçalhos de cada parte
+UPLOAD_CHUNK_SIZE = 64 * 1024
+# Tamanho dos blocos enviados ao baixar um relatório
+DOWNLOAD_CHUNK_SIZE = 64 * 1024
+MAX_PART_HEADER_SIZE = 16 * 1024
+
+# Campos de arquivo aceitos em POST /jobs
+UPLOAD_FIELDS = ('cliente', 'fornecedor')
+
+XLSX_CONTENT_TYPE = 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
+
+logger = logging.getLogger('AppGeraRelServer')
+
+# Erro de requisição HTTP com o status a ser devolvido ao cliente
+class HttpError(Exception):
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+        self.message = message
+
+# Função para calcular a chave do cache a partir das entradas e das opções do relatório
+def cache_key(client_hash, supplier_hash, options):
+    payload = json.dumps({
+        'cliente': client_hash,
+        'fornecedor': supplier_hash,
+        'opcoes': options,
+    }, sort_keys=True)
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+# Função para obter um parâmetro de um cabeçalho HTTP (ex.: boundary, name)
+def _header_param(header, value, param):
+    message = Message()
+    message[header] = value
+    return message.get_param(param, header=header)
+
+# Lê um corpo multipart/form-data em streaming: cada arquivo é gravado em disco e tem o
+# hash SHA-256 calculado enquanto os dados chegam, sem guardar o corpo inteiro em memória
+class MultipartUpload:
+    def __init__(self, reader, content_type, length, target_dir):
+        boundary = _header_param('content-type', content_type, 'boundary')
+        if not boundary:
+            raise HttpError(HTTPStatus.BAD_REQUEST, "Corpo multipart/form-data sem boundary")
+        self.reader = reader
+        self.remaining = length
+        self.target_dir = target_dir
+        self.delimiter = b'\r\n--' + boundary.encode('latin-1')
+        # O primeiro delimitador não é precedido de CRLF; o prefixo permite tratá-lo como os demais
+        self.buffer = bytearray(b'\r\n')
+        # campo -> (caminho do arquivo, hash SHA-256, tamanho)
+        self.files = {}
+
+    async def fill(self):
+        if self.remaining <= 0:
+            raise HttpError(HTTPStatus.BAD_REQUEST, "Corpo multipart/form-data incompleto")
+        chunk = await self.reader.read(min(UPLOAD_CHUNK_SIZE, self.remaining))
+        if not chunk:
+            raise asyncio.IncompleteReadError(bytes(self.buffer), self.remaining)
+        self.remaining -= len(chunk)
+        self.buffer += chunk
+
+    # Consome os dados até o próximo delimitador, repassando-os a write (se informado)
+    async def read_until_delimiter(self, write=None):
+        keep = len(self.delimiter) - 1
+        while True:
+            index = self.buffer.find(self.delimiter)
+            if index >= 0:
+                if write:
+                    write(self.buffer[:index])
+                del self.buffer[:index + len(self.delimiter)]
+                return
+            if len(self.buffer) > keep:
+                if write:
+                    write(self.buffer[:-keep])
+                del self.buffer[:-keep]
+            await self.fill()
+
+    async def read_part_headers(self):
+        while True:
+            index = self.buffer.find(b'\r\n\r\n')
+            if index >= 0:
+                break
+            if len(self.buffer) > MAX_PART_HEADER_SIZE:
+                raise HttpError(HTTPStatus.BAD_REQUEST, "Cabeçalhos da parte muito grandes")
+            await self.fill()
+        lines = bytes(self.buffer[:index]).decode('utf-8', 'replace').split('\r\n')
+        del self.buffer[:index + 4]
+        headers = {}
+        for line in lines:
+            if ':' in line:
+                name, value = line.split(':', 1)
+                headers[name.strip().lower()] = value.strip()
+        return headers
+
+    async def read_part_data(self, name):
+        if name not in UPLOAD_FIELDS:
+            await self.read_until_delimiter()
+            return
+        path = os.path.join(self.target_dir, f"{name}.xlsx")
+        digest = hashlib.sha256()
+        size = 0
+        with open(path, 'wb') as f:
+            def write(data):
+                nonlocal size
+                digest.update(data)
+                f.write(data)
+                size += len(data)
+            await self.read_until_delimiter(write)
+        self.files[name] = (path, digest.hexdigest(), size)
+
+    async def read(self):
+        await self.read_until_delimiter()
+        while True:
+            while len(self.buffer) < 2:
+                await self.fill()
+            marker = bytes(self.buffer[:2])
+            del self.buffer[:2]
+            if marker == b'--':
+                break
+            if marker != b'\r\n':
+                raise HttpError(HTTPStatus.BAD_REQUEST, "Corpo multipart/form-data inválido")
+            headers = await self.read_part_headers()
+            name = _header_param('content-disposition', headers.get('content-disposition', ''), 'name')
+            await self.read_part_data(name)
+        # Descarta o epílogo, se houver
+        while self.remaining > 0:
+            self.buffer.clear()
+            await self.fill()
+        return self.files
+
+# Job de geração de relatório e seu estado
+class ReportJob:
+    def __init__(self, key):
+        self.id = uuid.uuid4().hex
+        self.key = key
+        self.status = 'na_fila'
+        self.step = 0
+        self.total_steps = 0
+        self.description = ''
+        self.error = None
+        self.cached = False
+        self.created = time.time()
+        self.finished = None
+
+    def finish(self, status, error=None):
+        self.status = status
+        self.error = error
+        self.finished = time.time()
+        if status == 'concluido':
+            self.step = self.total_steps = self.total_steps or 1
+
+    def to_dict(self):
+        progress = round(100.0 * self.step / self.total_steps, 1) if self.total_steps else 0.0
+        data = {
+            'id': self.id,
+            'status': self.status,
+            'progresso': progress,
+            'etapa': self.description,
+            'cache': self.cached,
+        }
+        if self.error:
+            data['erro'] = self.error
+        if self.status == 'concluido':
+            data['resultado'] = f"/jobs/{self.id}/resultado"
+        return data
+
+# Serviço HTTP local que gera os relatórios em um pool limitado de processos
+class ReportService:
+    def __init__(self, cache_dir, max_workers=2, max_upload_mb=100, max_cache_entries=200):
+        self.cache_dir = os.path.abspath(cache_dir)
+        self.work_dir = os.path.join(self.cache_dir, 'tmp')
+        self.max_workers = max_workers
+        self.max_upload = max_upload_mb * 1024 * 1024
+        self.max_cache_entries = max_cache_entries
+        self.options = {'ano_corrente': CURRENT_YEAR, 'versao': REPORT_FORMAT_VERSION}
+        self.jobs = {}
+        # chave do cache -> job em andamento, para reaproveitar requisições idênticas simultâneas
+        self.running = {}
+        self.executor = None
+        self.manager = None
+        self.progress_queue = None
+        self.loop = None
+
+    def result_path(self, key):
+        return os.path.join(self.cache_dir, f"{key}.xlsx")
+
+    async def start(self):
+        os.makedirs(self.work_dir, exist_ok=True)
+        self.loop = asyncio.get_running_loop()
+        self.start_executor()
+        self.manager = multiprocessing.Manager()
+        self.progress_queue = self.manager.Queue()
+        threading.Thread(target=self.read_progress, daemon=True).start()
+
+    def start_executor(self):
+        self.executor = ProcessPoolExecutor(max_workers=self.max_workers, initializer=ignore_sigint)
+
+    # Substitui o pool interrompido (ex.: processo de trabalho morto pelo OOM killer), que
+    # recusaria todos os jobs seguintes; só o primeiro job a perceber a falha o substitui
+    def replace_executor(self, broken_executor):
+        if broken_executor is not self.executor:
+            return
+        logger.warning("Processo de trabalho interrompido; recriando o pool de processos")
+        broken_executor.shutdown(wait=False)
+        self.start_executor()
+
+    # Libera o que start() chegou a criar (pode ser chamado após uma inicialização parcial)
+    def stop(self):
+        if self.executor is not None:
+            self.executor.shutdown(wait=True, cancel_futures=True)
+        if self.manager is not None:
+            if self.progress_queue is not None:
+                self.progress_queue.put(None)
+            self.manager.shutdown()
+        shutil.rmtree(self.work_dir, ignore_errors=True)
+
+    # Lê o progresso enviado pelos processos de trabalho e repassa ao laço de eventos
+    def read_progress(self):
+        while True:
+            try:
+                item = self.progress_queue.get()
+            except (EOFError, OSError):
+                return
+            if item is None:
+                return
+            self.loop.call_soon_threadsafe(self.update_progress, *item)
+
+    def update_progress(self, job_id, step, total_steps, description):
+        job = self.jobs.get(job_id)
+        if job and job.status in ('na_fila', 'processando'):
+            job.status = 'processando'
+            job.step, job.total_steps, job.description = step, total_steps, description
+
+    def add_job(self, job):
+        self.jobs[job.id] = job
+        finished = [j for j in self.jobs.values() if j.finished is not None]
+        if len(finished) > MAX_FINISHED_JOBS:
+            finished.sort(key=lambda j: j.finished)
+            for old in finished[:len(finished) - MAX_FINISHED_JOBS]:
+                del self.jobs[old.id]
+
+    # Remove os resultados mais antigos quando o cache passa do limite
+    def prune_cache(self):
+        entries = []
+        for entry in os.scandir(self.cache_dir):
+            if entry.is_file() and entry.name.endswith('.xlsx'):
+                entries.append((entry.stat().st_mtime, entry.path))
+        entries.sort()
+        for _, path in entries[:max(0, len(entries) - self.max_cache_entries)]:
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+    # Cria (ou reaproveita) o job para um par de arquivos enviados; a pasta do envio passa a
+    # pertencer ao job criado ou é removida quando o resultado vem do cache ou de outro job
+    def submit(self, upload_dir, files):
+        (client_file, client_hash, _), (supplier_file, supplier_hash, _) = files['cliente'], files['fornecedor']
+        key = cache_key(client_hash, supplier_hash, self.options)
+        if key in self.running:
+            shutil.rmtree(upload_dir, ignore_errors=True)
+            return self.running[key]
+        job = ReportJob(key)
+        self.add_job(job)
+        result = self.result_path(key)
+        if os.path.exists(result):
+            shutil.rmtree(upload_dir, ignore_errors=True)
+            os.utime(result)
+            job.cached = True
+            job.description = "Resultado obtido do cache"
+            job.finish('concluido')
+            return job
+        self.running[key] = job
+        asyncio.ensure_future(self.run_job(job, upload_dir, client_file, supplier_file))
+        return job
+
+    async def run_job(self, job, job_dir, client_file, supplier_file):
+        try:
+            for attempt in range(MAX_POOL_RESTARTS + 1):
+                executor = self.executor
+                try:
+                    await self.loop.run_in_executor(
+                        executor, run_report_job, client_file, supplier_file,
+                        self.result_path(job.key), self.progress_queue, job.id)
+                    break
+                except BrokenProcessPool:
+                    if attempt == MAX_POOL_RESTARTS:
+                        raise
+                    logger.warning("Job %s interrompido junto com o processo de trabalho; reenviando", job.id)
+                    self.replace_executor(executor)
+                    job.status = 'na_fila'
+                    job.step = 0
+                    job.description = "Reenviado após interrupção do processo de trabalho"
+            job.finish('concluido')
+            self.prune_cache()
+        except Exception as e:
+            logger.error("Falha no job %s: %s", job.id, e)
+            job.finish('erro', str(e))
+        finally:
+            self.running.pop(job.key, None)
+            shutil.rmtree(job_dir, ignore_errors=True)
+
+    # Trata uma conexão HTTP (uma requisição por conexão)
+    async def handle_connection(self, reader, writer):
+        try:
+            try:
+                method, path, headers, length = await self.read_request(reader)
+                status, content_type, payload, extra = await self.route(method, path, headers, reader, writer, length)
+            except HttpError as e:
+                status, content_type, payload, extra = self.json_response(e.status, {'erro': e.message})
+            await self.write_response(writer, status, content_type, payload, extra)
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        except Exception:
+            logger.exception("Erro inesperado ao tratar requisição")
+        finally:
+            writer.close()
+
+    async def read_request(self, reader):
+        try:
+            head = await reader.readuntil(b'\r\n\r\n')
+        except asyncio.LimitOverrunError:
+            raise HttpError(HTTPStatus.REQUEST_HEADER_FIELDS_TOO_LARGE, "Cabeçalhos muito grandes")
+        lines = head.decode('latin-1').split('\r\n')
+        try:
+            method, path, _ = lines[0].split(' ', 2)
+        except ValueError:
+            raise HttpError(HTTPStatus.BAD_REQUEST, "Linha de requisição inválida")
+        headers = {}
+        for line in lines[1:]:
+            if ':' in line:
+                name, value = line.split(':', 1)
+                headers[name.strip().lower()] = value.strip()
+        if 'chunked' in headers.get('transfer-encoding', '').lower():
+            raise HttpError(HTTPStatus.LENGTH_REQUIRED, "Envie o corpo com Content-Length")
+        try:
+            length = int(headers.get('content-length', '0'))
+        except ValueError:
+            raise HttpError(HTTPStatus.BAD_REQUEST, "Content-Length inválido")
+        if length > self.max_upload:
+            raise HttpError(HTTPStatus.REQUEST_ENTITY_TOO_LARGE, "Arquivos maiores que o limite permitido")
+        return method.upper(), path.split('?', 1)[0], headers, length
+
+    # Recebe os arquivos de POST /jobs em uma pasta temporária
+    async def receive_upload(self, reader, headers, length):
+        upload_dir = tempfile.mkdtemp(dir=self.work_dir)
+        try:
+            files = await MultipartUpload(reader, headers.get('content-type', ''), length, upload_dir).read()
+            missing = [name for name in UPLOAD_FIELDS if not files.get(name, (None, None, 0))[2]]
+            if missing:
+                raise HttpError(HTTPStatus.BAD_REQUEST, f"Campos ausentes: {', '.join(missing)}")
+        except BaseException:
+            shutil.rmtree(upload_dir, ignore_errors=True)
+            raise
+        return upload_dir, files
+
+    async def route(self, method, path, headers, reader, writer, length):
+        if path == '/jobs':
+            if method != 'POST':
+                raise HttpError(HTTPStatus.METHOD_NOT_ALLOWED, "Use POST para criar um job")
+            content_type = headers.get('content-type', '')
+            if not content_type.lower().startswith('multipart/form-data'):
+                raise HttpError(HTTPStatus.UNSUPPORTED_MEDIA_TYPE, "Envie os arquivos como multipart/form-data")
+            # Clientes como o curl aguardam esta resposta antes de enviar arquivos grandes
+            if headers.get('expect', '').lower() == '100-continue':
+                writer.write(b'HTTP/1.1 100 Continue\r\n\r\n')
+                await writer.drain()
+            upload_dir, files = await self.receive_upload(reader, headers, length)
+            job = self.submit(upload_dir, files)
+            status = HTTPStatus.OK if job.status == 'concluido' else HTTPStatus.ACCEPTED
+            return self.json_response(status, job.to_dict(), {'Location': f"/jobs/{job.id}"})
+
+        match = re.fullmatch(r'/jobs/([0-9a-f]{32})(/resultado)?', path)
+        if not match:
+            raise HttpError(HTTPStatus.NOT_FOUND, "Recurso não encontrado")
+        if method != 'GET':
+            raise HttpError(HTTPStatus.METHOD_NOT_ALLOWED, "Use GET para consultar um job")
+        job = self.jobs.get(match.group(1))
+        if job is None:
+            raise HttpError(HTTPStatus.NOT_FOUND, "Job não encontrado")
+        if not match.group(2):
+            return self.json_response(HTTPStatus.OK, job.to_dict())
+        if job.status != 'concluido':
+            raise HttpError(HTTPStatus.CONFLICT, f"Job ainda não concluído (status: {job.status})")
+        # O arquivo aberto é enviado em blocos por write_response, que o fecha ao final
+        try:
+            result_file = await self.loop.run_in_executor(None, open, self.result_path(job.key), 'rb')
+        except FileNotFoundError:
+            raise HttpError(HTTPStatus.GONE, "Resultado removido do cache; envie os arquivos novamente")
+        disposition = {'Content-Disposition': f'attachment; filename="relatorio-{job.key[:12]}.xlsx"'}
+        return HTTPStatus.OK, XLSX_CONTENT_TYPE, result_file, disposition
+
+    @staticmethod
+    def json_response(status, data, extra=None):
+        payload = json.dumps(data, ensure_ascii=False).encode('utf-8')
+        return status, 'application/json; charset=utf-8', payload, extra or {}
+
+    # Envia a resposta; payload é um bytes ou um arquivo aberto, enviado em blocos lidos fora do
+    # laço de eventos para não bloquear as demais requisições nem carregar o arquivo em memória
+    @staticmethod
+    async def write_response(writer, status, content_type, payload, extra):
+        is_file = not isinstance(payload, bytes)
+        try:
+            length = os.fstat(payload.fileno()).st_size if is_file else len(payload)
+            status = HTTPStatus(status)
+            head = [f"HTTP/1.1 {status.value} {status.phrase}",
+                    f"Content-Type: {content_type}",
+                    f"Content-Length: {length}",
+                    "Connection: close"]
+            head += [f"{name}: {value}" for name, value in extra.items()]
+            writer.write(('\r\n'.join(head) + '\r\n\r\n').encode('latin-1'))
+            if not is_file:
+                writer.write(payload)
+                await writer.drain()
+                return
+            loop = asyncio.get_running_loop()
+            remaining = length
+            while remaining > 0:
+                chunk = await loop.run_in_executor(None, payload.read, min(DOWNLOAD_CHUNK_SIZE, remaining))
+                if not chunk:
+                    break
+                remaining -= len(chunk)
+                writer.write(chunk)
+                await writer.drain()
+        finally:
+            if is_file:
+                payload.close()
+
+async def serve(host, port, service):
+    # start_server fica dentro do try: se a porta estiver ocupada, o pool, o gerenciador e a
+    # pasta temporária criados por service.start() também são liberados
+    try:
+        await service.start()
+        server = await asyncio.start_server(service.handle_connection, host, port, limit=64 * 1024)
+        logger.info("Serviço de relatórios em http://%s:%d (cache em %s)", host, port, service.cache_dir)
+        async with server:
+            await server.serve_forever()
+    finally:
+        service.stop()
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Serviço HTTP local para geração dos relatórios Excel.")
+    parser.add_argument('--host', default='127.0.0.1', help="Endereço de escuta (padrão: 127.0.0.1)")
+    parser.add_argument('--port', type=int, default=8765, help="Porta de escuta (padrão: 8765)")
+    parser.add_argument('--cache-dir', default='relatorios_cache', help="Pasta do cache de resultados (padrão: relatorios_cache)")
+    parser.add_argument('--cache-size', type=int, default=200, help="Número máximo de relatórios no cache (padrão: 200)")
+    parser.add_argument('--workers', type=int, default=2, help="Número máximo de relatórios gerados em paralelo (padrão: 2)")
+    parser.add_argument('--max-upload-mb', type=int, default=100, help="Tamanho máximo do envio, em MB (padrão: 100)")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s %(levelname)s %(message)s')
+    service = ReportService(args.cache_dir, max_workers=max(1, args.workers),
+                            max_upload_mb=args.max_upload_mb, max_cache_entries=max(1, args.cache_size))
+    try:
+        asyncio.run(serve(args.host, args.port, service))
+    except KeyboardInterrupt:
+        pass
+    except OSError as e:
+        logger.error("Falha ao iniciar o serviço: %s", e)
+        return 1
+    return 0
+
+# Executar o serviço
+if __name__ == "__main__":
+    multiprocessing.freeze_support()
+    sys.exit(main())
@@ -0,0 +1,275 @@
+import argparse
+import hashlib
+import json
+import logging
+import multiprocessing
+import os
+import re
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+from AppGeraRel import ignore_sigint, run_report_job
+
+# Padrão do nome das exportações: prefixo do relatório (ex.: CMCL904) seguido de '-'
+EXPORT_NAME_PATTERN = re.compile(r'^([A-Za-z]+\d+)-', re.IGNORECASE)
+EXCEL_EXTENSIONS = ('.xlsx', '.xls')
+
+# Arquivo (na pasta de saída) com os hashes das entradas já processadas: em 'gerados' as que
+# geraram relatório e em 'falhas' as que falharam (só há nova tentativa se alguma entrada mudar)
+STATE_FILE = '.appgerarel-watch.json'
+
+# Número de vezes que --once recria o pool e reenvia os relatórios se um processo de trabalho morrer
+MAX_POOL_RESTARTS = 2
+
+logger = logging.getLogger('AppGeraRelWatch')
+
+# Função para identificar o relatório e o tipo (cliente/fornecedor) pelo nome do arquivo
+def classify_export(file_name):
+    if file_name.startswith(('~$', '.')) or not file_name.lower().endswith(EXCEL_EXTENSIONS):
+        return None
+    match = EXPORT_NAME_PATTERN.match(file_name)
+    if not match:
+        return None
+    name = file_name.upper()
+    # CMCL999-CLIENTE-FORNECEDOR é a exportação de fornecedor, por isso FORNECEDOR vem primeiro
+    if 'FORNECEDOR' in name:
+        kind = 'fornecedor'
+    elif 'CLIENTE' in name:
+        kind = 'cliente'
+    else:
+        return None
+    return match.group(1).upper(), kind
+
+# Função para calcular o hash SHA-256 do conteúdo de um arquivo
+def file_sha256(file_path, chunk_size=1024 * 1024):
+    digest = hashlib.sha256()
+    with open(file_path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+# Monitora uma pasta de entrada e gera os relatórios quando novas exportações chegam
+class ReportWatcher:
+    def __init__(self, input_dir, output_dir=None, poll_interval=2.0, debounce=5.0, max_workers=2):
+        self.input_dir = os.path.abspath(input_dir)
+        self.output_dir = os.path.abspath(output_dir or input_dir)
+        self.poll_interval = poll_interval
+        self.debounce = debounce
+        self.max_workers = max_workers
+        self.executor = None
+        self.state_file = os.path.join(self.output_dir, STATE_FILE)
+        state = self.load_state()
+        # relatório -> assinatura das entradas do último relatório gerado
+        self.generated = state.get('gerados', {})
+        # relatório -> assinatura que falhou (só tenta de novo se as entradas mudarem)
+        self.failed = state.get('falhas', {})
+        # caminho -> (tamanho, mtime, instante em que essa assinatura foi vista pela primeira vez)
+        self.seen = {}
+        # caminho -> ((tamanho, mtime), hash) para não recalcular hash de arquivo inalterado
+        self.hash_cache = {}
+        # relatório -> (future, assinatura das entradas, pool em que foi enviado)
+        self.running = {}
+
+    def load_state(self):
+        try:
+            with open(self.state_file, encoding='utf-8') as f:
+                state = json.load(f)
+            if not isinstance(state, dict):
+                raise ValueError("formato inesperado")
+            return state
+        except FileNotFoundError:
+            return {}
+        except (OSError, ValueError) as e:
+            logger.warning("Estado inválido em %s, ignorando: %s", self.state_file, e)
+            return {}
+
+    def save_state(self):
+        fd, temp_file = tempfile.mkstemp(prefix='.', suffix='.json.tmp', dir=self.output_dir)
+        try:
+            with os.fdopen(fd, 'w', encoding='utf-8') as f:
+                json.dump({'gerados': self.generated, 'falhas': self.failed}, f, indent=2, sort_keys=True)
+            os.replace(temp_file, self.state_file)
+        except BaseException:
+            if os.path.exists(temp_file):
+                os.remove(temp_file)
+            raise
+
+    def output_path(self, key):
+        return os.path.join(self.output_dir, f"{key}-RELATORIO.xlsx")
+
+    def file_hash(self, path, stat_key):
+        cached = self.hash_cache.get(path)
+        if cached and cached[0] == stat_key:
+            return cached[1]
+        digest = file_sha256(path)
+        self.hash_cache[path] = (stat_key, digest)
+        return digest
+
+    # Lista as exportações estáveis (sem alteração durante o debounce), agrupadas por relatório
+    def scan(self, now, debounce):
+        pairs = {}
+        current = set()
+        try:
+            entries = list(os.scandir(self.input_dir))
+        except OSError as e:
+            logger.error("Falha ao listar %s: %s", self.input_dir, e)
+            return pairs
+        for entry in entries:
+            classified = classify_export(entry.name)
+            if classified is None or not entry.is_file():
+                continue
+            try:
+                st = entry.stat()
+            except OSError:
+                continue
+            path = entry.path
+            current.add(path)
+            stat_key = (st.st_size, st.st_mtime_ns)
+            previous = self.seen.get(path)
+            if previous is None or previous[:2] != stat_key:
+                self.seen[path] = stat_key + (now,)
+                if debounce > 0:
+                    continue
+            elif now - previous[2] < debounce:
+                continue
+            key, kind = classified
+            # Se houver mais de uma exportação do mesmo tipo, usa a mais recente
+            best = pairs.setdefault(key, {}).get(kind)
+            if best is None or st.st_mtime_ns > best[1][1]:
+                pairs[key][kind] = (path, stat_key)
+        for path in list(self.seen):
+            if path not in current:
+                del self.seen[path]
+                self.hash_cache.pop(path, None)
+        return pairs
+
+    def start_executor(self):
+        self.executor = ProcessPoolExecutor(max_workers=self.max_workers, initializer=ignore_sigint)
+
+    # Recria o pool quando um processo de trabalho morre (ex.: OOM killer), pois o pool
+    # interrompido recusa novos envios; os relatórios afetados são reenviados
+    def restart_executor(self):
+        logger.warning("Processo de trabalho interrompido; recriando o pool de processos")
+        self.executor.shutdown(wait=False, cancel_futures=True)
+        self.start_executor()
+
+    # Enfileira os relatórios cujas entradas mudaram desde a última geração
+    def submit_jobs(self, pairs):
+        for key, files in sorted(pairs.items()):
+            if 'cliente' not in files or 'fornecedor' not in files or key in self.running:
+                continue
+            (client_file, client_stat), (supplier_file, supplier_stat) = files['cliente'], files['fornecedor']
+            try:
+                signature = {
+                    'cliente': self.file_hash(client_file, client_stat),
+                    'fornecedor': self.file_hash(supplier_file, supplier_stat),
+                }
+            except OSError as e:
+                logger.warning("Falha ao ler entradas de %s: %s", key, e)
+                continue
+            output_file = self.output_path(key)
+            if self.generated.get(key) == signature and os.path.exists(output_file):
+                continue
+            if self.failed.get(key) == signature:
+                continue
+            logger.info("Gerando %s a partir de %s e %s", output_file,
+                        os.path.basename(client_file), os.path.basename(supplier_file))
+            try:
+                future = self.executor.submit(run_report_job, client_file, supplier_file, output_file)
+            except BrokenProcessPool:
+                self.restart_executor()
+                future = self.executor.submit(run_report_job, client_file, supplier_file, output_file)
+            self.running[key] = (future, signature, self.executor)
+
+    # Registra o resultado dos relatórios concluídos; retorna True se algum foi perdido porque
+    # um processo de trabalho morreu (esses não contam como falha e voltam a ser enviados)
+    def collect_jobs(self):
+        changed = False
+        broken = False
+        for key, (future, signature, executor) in list(self.running.items()):
+            if not future.done():
+                continue
+            del self.running[key]
+            try:
+                output_file = future.result()
+            except BrokenProcessPool:
+                logger.warning("Relatório %s interrompido junto com o processo de trabalho; será reenviado", key)
+                broken = broken or executor is self.executor
+                continue
+            except Exception as e:
+                self.failed[key] = signature
+                changed = True
+                logger.error("Falha ao gerar relatório %s: %s", key, e)
+                continue
+            self.failed.pop(key, None)
+            self.generated[key] = signature
+            changed = True
+            logger.info("Relatório gerado: %s", output_file)
+        if changed:
+            self.save_state()
+        if broken:
+            self.restart_executor()
+        return broken
+
+    def wait_jobs(self):
+        for future, _, _ in list(self.running.values()):
+            future.exception()
+        return self.collect_jobs()
+
+    # Processa uma única vez as exportações presentes na pasta e retorna
+    def run_once(self):
+        self.start_executor()
+        try:
+            for _ in range(MAX_POOL_RESTARTS + 1):
+                self.submit_jobs(self.scan(time.monotonic(), debounce=0))
+                if not self.wait_jobs():
+                    break
+            else:
+                logger.error("Processos de trabalho interrompidos repetidamente; encerrando")
+        finally:
+            self.executor.shutdown(wait=True)
+
+    # Laço principal: monitora a pasta até ser interrompido (Ctrl+C)
+    def run_forever(self):
+        logger.info("Monitorando %s (saída em %s)", self.input_dir, self.output_dir)
+        self.start_executor()
+        try:
+            while True:
+                self.collect_jobs()
+                self.submit_jobs(self.scan(time.monotonic(), self.debounce))
+                time.sleep(self.poll_interval)
+        except KeyboardInterrupt:
+            logger.info("Encerrando; aguardando relatórios em andamento...")
+        try:
+            self.wait_jobs()
+        finally:
+            self.executor.shutdown(wait=True)
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Monitora uma pasta e gera os relatórios Excel quando chegam exportações CLIENTE/FORNECEDOR.")
+    parser.add_argument('input_dir', help="Pasta monitorada com as exportações")
+    parser.add_argument('-o', '--output-dir', help="Pasta onde os relatórios são gravados (padrão: a pasta monitorada)")
+    parser.add_argument('--interval', type=float, default=2.0, help="Intervalo entre varreduras, em segundos (padrão: 2)")
+    parser.add_argument('--debounce', type=float, default=5.0,
+                        help="Tempo sem alterações antes de processar um arquivo, em segundos (padrão: 5)")
+    parser.add_argument('--workers', type=int, default=2, help="Número máximo de relatórios gerados em paralelo (padrão: 2)")
+    parser.add_argument('--once', action='store_true', help="Processa as exportações atuais e encerra")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s %(levelname)s %(message)s')
+    if args.output_dir:
+        os.makedirs(args.output_dir, exist_ok=True)
+    watcher = ReportWatcher(args.input_dir, args.output_dir, poll_interval=args.interval,
+                            debounce=args.debounce, max_workers=max(1, args.workers))
+    if args.once:
+        watcher.run_once()
+    else:
+        watcher.run_forever()
+
+# Executar o monitoramento
+if __name__ == "__main__":
+    multiprocessing.freeze_support()
+    main()